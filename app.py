@@ -1,131 +1,481 @@
 import pandas as pd
-from itertools import combinations
+import numpy as np
+from numba import njit
+from joblib import Parallel, delayed
 from flask import Flask, request, send_file # Se eliminó render_template
 import io
 import os
+import logging
 from flask_cors import CORS
 from pandas.errors import EmptyDataError 
+from redis import Redis
+from rq import Queue
+from rq.job import Job, JobStatus
+from rq.exceptions import NoSuchJobError
+
+# Configurar el registro de eventos (reemplaza los print a stdout)
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # Inicializar la aplicación Flask
 app = Flask(__name__)
 # Configuración explícita de CORS
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Cola de trabajos en segundo plano (RQ sobre Redis): el procesamiento se ejecuta en
+# un worker aparte y la petición web solo valida el archivo y encola el trabajo
+redis_conn = Redis.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379'))
+cola = Queue(connection=redis_conn)
+
+# Tiempo máximo de un trabajo y tiempo que se conserva su resultado (segundos)
+TIEMPO_MAXIMO_TRABAJO = 1800
+TIEMPO_RESULTADO = 3600
+
 # --- Lógica de Procesamiento del Script Original ---
 
-def es_cobertura_valida(monto_pago, monto_objetivo, tolerancia=1.0):
+# Tipos de cobertura devueltos por los buscadores (0 = sin coincidencia)
+PORCENTAJES = {1: "100%", 2: "88%"}
+
+# Los montos se comparan como enteros en centésimas de centavo, para que el 88% de
+# una factura sea exacto; la tolerancia es de ±1.00
+TOLERANCIA = 10000
+
+# Posiciones vacías para valores ausentes de un índice invertido
+SIN_POSICIONES = np.empty(0, dtype=np.int64)
+
+# Entre estas cantidades de pagos por cliente, las combinaciones se buscan con
+# encuentro a mitad de camino en lugar de ramificación y poda. El máximo limita la
+# memoria de las mitades enumeradas (C(n, 3) filas, unos 26 MB con 150 pagos).
+UMBRAL_MITM = 20
+UMBRAL_MITM_MAXIMO = 150
+
+@njit(cache=True, nogil=True)
+def enumerar_subconjuntos(montos, k):
+    """
+    Enumera todos los subconjuntos de k posiciones (en orden creciente) y sus sumas.
+    Devuelve (sumas, posiciones) con una fila de posiciones por subconjunto.
+    """
+    n = montos.shape[0]
+    total = 1
+    for t in range(k):
+        total = total * (n - t) // (t + 1)
+
+    sumas = np.empty(total, dtype=montos.dtype)
+    posiciones = np.empty((total, k), dtype=np.int64)
+    if total == 0:
+        return sumas, posiciones
+
+    indices = np.arange(k)
+    for fila in range(total):
+        suma = montos[indices[0]]
+        posiciones[fila, 0] = indices[0]
+        for t in range(1, k):
+            suma += montos[indices[t]]
+            posiciones[fila, t] = indices[t]
+        sumas[fila] = suma
+
+        # Avanzar a la siguiente combinación en orden lexicográfico
+        t = k - 1
+        while t >= 0 and indices[t] == n - k + t:
+            t -= 1
+        if t < 0:
+            break
+        indices[t] += 1
+        for u in range(t + 1, k):
+            indices[u] = indices[u - 1] + 1
+
+    return sumas, posiciones
+
+@njit(cache=True, nogil=True)
+def enumerar_mitades(montos):
+    """
+    Prepara las mitades para el encuentro a mitad de camino: para k = 1, 2 y 3 devuelve
+    (sumas, posiciones, orden, ordenadas), donde orden ordena las sumas y ordenadas = sumas[orden].
+    Depende solo de los pagos disponibles, por lo que se reutiliza mientras no cambien.
+    """
+    sumas_1, posiciones_1 = enumerar_subconjuntos(montos, 1)
+    orden_1 = np.argsort(sumas_1, kind='mergesort')
+    sumas_2, posiciones_2 = enumerar_subconjuntos(montos, 2)
+    orden_2 = np.argsort(sumas_2, kind='mergesort')
+    sumas_3, posiciones_3 = enumerar_subconjuntos(montos, 3)
+    orden_3 = np.argsort(sumas_3, kind='mergesort')
+    return (
+        (sumas_1, posiciones_1, orden_1, sumas_1[orden_1]),
+        (sumas_2, posiciones_2, orden_2, sumas_2[orden_2]),
+        (sumas_3, posiciones_3, orden_3, sumas_3[orden_3]),
+    )
+
+@njit(cache=True, nogil=True)
+def buscar_en_mitades(izq, der, objetivo_100, objetivo_88, tolerancia):
+    """
+    Busca, en el orden de itertools.combinations, la primera combinación formada por un
+    subconjunto izquierdo y uno derecho que cubra la factura (100% antes que 88%).
+    Solo se aceptan pares en los que todas las posiciones izquierdas preceden a las
+    derechas, de modo que cada combinación se considera una sola vez. Las filas de cada
+    mitad están en orden lexicográfico, así que la primera fila izquierda con pareja y,
+    para ella, la menor fila derecha dan la primera combinación.
+    """
+    sumas_izq, posiciones_izq = izq[0], izq[1]
+    posiciones_der, orden_der, der_ordenadas = der[1], der[2], der[3]
+    ultima = posiciones_izq.shape[1] - 1
+
+    for fila in range(sumas_izq.shape[0]):
+        mejor = -1
+        tipo = 0
+        for tipo_objetivo, objetivo in ((1, objetivo_100), (2, objetivo_88)):
+            resto = objetivo - sumas_izq[fila]
+            desde = np.searchsorted(der_ordenadas, resto - tolerancia, side='left')
+            hasta = np.searchsorted(der_ordenadas, resto + tolerancia, side='right')
+            for q in range(desde, hasta):
+                f = orden_der[q]
+                if posiciones_der[f, 0] > posiciones_izq[fila, ultima] and (mejor < 0 or f < mejor):
+                    mejor = f
+                    tipo = tipo_objetivo
+        if mejor >= 0:
+            return np.concatenate((posiciones_izq[fila], posiciones_der[mejor])), tipo
+
+    return np.empty(0, dtype=np.int64), 0
+
+@njit(cache=True, nogil=True)
+def buscar_combinacion_mitm(mitades, objetivo_100, objetivo_88, tolerancia, max_r):
+    """
+    Busca combinaciones de 2 a max_r (<= 5) pagos con encuentro a mitad de camino:
+    cada combinación de r pagos se divide en sus primeras r // 2 posiciones y el resto,
+    y la otra mitad se localiza con búsqueda binaria sobre sus sumas ordenadas.
+    mitades es el resultado de enumerar_mitades. Elige la misma combinación que
+    buscar_combinacion y devuelve (posiciones, tipo) igual que esta.
+    """
+    for r in range(2, max_r + 1):
+        if r == 2:
+            combo, tipo = buscar_en_mitades(mitades[0], mitades[0], objetivo_100, objetivo_88, tolerancia)
+        elif r == 3:
+            combo, tipo = buscar_en_mitades(mitades[0], mitades[1], objetivo_100, objetivo_88, tolerancia)
+        elif r == 4:
+            combo, tipo = buscar_en_mitades(mitades[1], mitades[1], objetivo_100, objetivo_88, tolerancia)
+        else:
+            combo, tipo = buscar_en_mitades(mitades[1], mitades[2], objetivo_100, objetivo_88, tolerancia)
+        if tipo:
+            return combo, tipo
+
+    return np.empty(0, dtype=np.int64), 0
+
+@njit(cache=True, nogil=True)
+def cotas_sufijo(montos, max_r):
+    """
+    Calcula, para cada posición i y cada k <= max_r, la mayor y la menor suma posible
+    de k pagos tomados de montos[i:]. Devuelve (techos, pisos), indexados como [k, i].
+    """
+    n = montos.shape[0]
+    techos = np.zeros((max_r + 1, n + 1), dtype=montos.dtype)
+    pisos = np.zeros((max_r + 1, n + 1), dtype=montos.dtype)
+    mayores = np.empty(max_r, dtype=montos.dtype)
+    menores = np.empty(max_r, dtype=montos.dtype)
+    cuenta = 0
+
+    for i in range(n - 1, -1, -1):
+        monto = montos[i]
+
+        # Mantener los max_r mayores (descendente) y los max_r menores (ascendente) del sufijo
+        if cuenta < max_r or monto > mayores[max_r - 1]:
+            j = min(cuenta, max_r - 1)
+            while j > 0 and mayores[j - 1] < monto:
+                mayores[j] = mayores[j - 1]
+                j -= 1
+            mayores[j] = monto
+        if cuenta < max_r or monto < menores[max_r - 1]:
+            j = min(cuenta, max_r - 1)
+            while j > 0 and menores[j - 1] > monto:
+                menores[j] = menores[j - 1]
+                j -= 1
+            menores[j] = monto
+        cuenta += 1
+
+        techo = 0
+        piso = 0
+        for k in range(1, min(cuenta, max_r) + 1):
+            techo += mayores[k - 1]
+            piso += menores[k - 1]
+            techos[k, i] = techo
+            pisos[k, i] = piso
+
+    return techos, pisos
+
+@njit(cache=True, nogil=True)
+def buscar_con_poda(montos, techos, pisos, objetivo_100, objetivo_88, tolerancia, r):
+    """
+    Busca la primera combinación de r pagos, en el orden de itertools.combinations,
+    que cubra la factura; en cada combinación se prueba el 100% antes que el 88%.
+    Recorre las posiciones en profundidad (ramificación y poda) y descarta una rama
+    cuando, según las cotas de sufijo de cotas_sufijo, ninguno de los dos objetivos
+    es alcanzable con los pagos que faltan por elegir.
+    Devuelve (posiciones, tipo) igual que buscar_combinacion.
+    """
+    n = montos.shape[0]
+    seleccion = np.empty(r, dtype=np.int64)
+    nivel = 0
+    i = 0
+    suma = 0
+
+    while True:
+        if nivel == r:
+            if -tolerancia <= suma - objetivo_100 <= tolerancia:
+                return seleccion, 1
+            if -tolerancia <= suma - objetivo_88 <= tolerancia:
+                return seleccion, 2
+            podar = True
+        elif i > n - (r - nivel):
+            podar = True
+        else:
+            techo = suma + techos[r - nivel, i]
+            piso = suma + pisos[r - nivel, i]
+            podar = not (
+                (piso <= objetivo_100 + tolerancia and techo >= objetivo_100 - tolerancia)
+                or (piso <= objetivo_88 + tolerancia and techo >= objetivo_88 - tolerancia)
+            )
+
+        if podar:
+            # Ninguna posición desde i sirve en este nivel: retroceder un nivel
+            if nivel == 0:
+                return np.empty(0, dtype=np.int64), 0
+            nivel -= 1
+            suma -= montos[seleccion[nivel]]
+            i = seleccion[nivel] + 1
+        else:
+            seleccion[nivel] = i
+            suma += montos[i]
+            nivel += 1
+            i += 1
+
+@njit(cache=True, nogil=True)
+def buscar_combinacion(montos, objetivo_100, objetivo_88, tolerancia, max_r):
+    """
+    Busca la primera combinación de 2 a max_r (<= 5) pagos que cubra la factura,
+    en el mismo orden que itertools.combinations y probando el 100% antes que el 88%.
+    Devuelve (posiciones, tipo) con tipo según PORCENTAJES; posiciones queda vacío
+    si no hay coincidencia.
+    """
+    n = montos.shape[0]
+    techos, pisos = cotas_sufijo(montos, max_r)
+    for r in range(2, min(max_r, n) + 1):
+        seleccion, tipo = buscar_con_poda(montos, techos, pisos, objetivo_100, objetivo_88, tolerancia, r)
+        if tipo:
+            return seleccion, tipo
+
+    return np.empty(0, dtype=np.int64), 0
+
+def a_centavos(montos):
+    """Convierte una serie de montos a centavos enteros (int64), redondeando al más cercano."""
+    return np.rint(montos.to_numpy(dtype=np.float64) * 100).astype(np.int64)
+
+def techo_combinaciones(montos, max_r=5):
+    """
+    Cota superior de la suma de cualquier combinación de hasta max_r pagos: ni la suma
+    de todos los montos positivos ni max_r veces el mayor monto pueden superarse.
+    """
+    if montos.size < 2:
+        return -np.inf
+    mayor = max(int(montos.max()), 0)
+    return min(int(montos[montos > 0].sum()), mayor * min(max_r, montos.size))
+
+def asociar_cliente(posiciones_facturas, posiciones_pagos, objetivos_100, objetivos_88, montos_pagos, disponibles):
+    """
+    Asocia las facturas de un cliente con sus pagos disponibles, en orden.
+    Marca en disponibles los pagos usados (solo las posiciones de este cliente) y
+    devuelve tres listas paralelas: posición de factura, posición de pago y porcentaje.
+    """
+    r_factura = []
+    r_pago = []
+    r_porcentaje = []
+
+    # Pagos disponibles del cliente; solo se recalculan tras una asociación
+    activos = posiciones_pagos
+    montos_activos = montos_pagos[activos]
+
+    # Búsquedas ya resueltas (con o sin coincidencia) para los pagos disponibles,
+    # por huella de los montos y valor de la factura
+    huella = hash(montos_activos.tobytes())
+    memoria = {}
+    techo = techo_combinaciones(montos_activos)
+
+    # Mitades enumeradas para el encuentro a mitad de camino; se preparan al necesitarlas
+    mitades = None
+
+    for i in posiciones_facturas:
+        # 1. Buscar coincidencia con un solo pago (escaneo vectorizado)
+        diferencia_100 = montos_activos - objetivos_100[i]
+        diferencia_88 = montos_activos - objetivos_88[i]
+        cubre_100 = (diferencia_100 >= -TOLERANCIA) & (diferencia_100 <= TOLERANCIA)
+        cubre_88 = (diferencia_88 >= -TOLERANCIA) & (diferencia_88 <= TOLERANCIA)
+        aciertos = np.flatnonzero(cubre_100 | cubre_88)
+
+        if aciertos.size:
+            combo = aciertos[:1]
+            tipo = 1 if cubre_100[combo[0]] else 2
+        else:
+            # 2. Buscar combinaciones de hasta 5 pagos, si alguna puede alcanzar la factura
+            if techo < min(objetivos_100[i], objetivos_88[i]) - TOLERANCIA:
+                continue
+
+            clave = (huella, int(objetivos_100[i]))
+            if clave not in memoria:
+                if UMBRAL_MITM < montos_activos.size <= UMBRAL_MITM_MAXIMO:
+                    if mitades is None:
+                        mitades = enumerar_mitades(montos_activos)
+                    memoria[clave] = buscar_combinacion_mitm(
+                        mitades, objetivos_100[i], objetivos_88[i], TOLERANCIA, 5
+                    )
+                else:
+                    memoria[clave] = buscar_combinacion(
+                        montos_activos, objetivos_100[i], objetivos_88[i], TOLERANCIA, 5
+                    )
+            combo, tipo = memoria[clave]
+            if not tipo:
+                continue
+
+        porcentaje = PORCENTAJES[tipo]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Factura en posición %d cubierta al %s con %d pago(s)", i, porcentaje, len(combo))
+        for j in activos[combo]:
+            r_factura.append(i)
+            r_pago.append(j)
+            r_porcentaje.append(porcentaje)
+
+        # Marcar como usados los pagos asociados
+        disponibles[activos[combo]] = False
+        activos = posiciones_pagos[disponibles[posiciones_pagos]]
+        if activos.size == 0:
+            break
+        montos_activos = montos_pagos[activos]
+        huella = hash(montos_activos.tobytes())
+        memoria.clear()
+        techo = techo_combinaciones(montos_activos)
+        mitades = None
+
+    return r_factura, r_pago, r_porcentaje
+
+def reducir_memoria(df):
     """
-    Verifica si la suma está dentro del rango permitido (±1.00) del monto objetivo.
+    Reduce la memoria de las columnas requeridas tras la lectura: TRX_NUMBER pasa al
+    entero más pequeño que lo contenga solo si al volver a texto queda idéntico (los
+    identificadores como '00123' se conservan como texto) y CUSTOMER_NAME a categoría.
+    INV_AMOUNT se mantiene en float64, porque float32 no conserva los centavos de
+    montos superiores a unos 167.000.
     """
-    return abs(monto_pago - monto_objetivo) <= tolerancia
+    trx_texto = df['TRX_NUMBER'].astype('string')
+    try:
+        trx = pd.to_numeric(trx_texto, downcast='integer')
+        if trx.dtype.kind in 'iu' and trx.astype('string').equals(trx_texto):
+            df['TRX_NUMBER'] = trx
+    except (ValueError, TypeError):
+        pass  # TRX alfanuméricos: se conservan como texto
+
+    df['CUSTOMER_NAME'] = df['CUSTOMER_NAME'].astype('category')
+    return df
+
+def indice_invertido(frame, columna):
+    """
+    Construye en una sola pasada un índice invertido valor -> posiciones (int64) de las
+    filas de frame, para consultar cada valor con una búsqueda en diccionario en lugar
+    de recorrer la columna completa.
+    """
+    return {
+        valor: posiciones.astype(np.int64, copy=False)
+        for valor, posiciones in frame.groupby(columna, sort=False, observed=True).indices.items()
+    }
 
 def procesar_archivos_excel(df):
     """
     Ejecuta la lógica de asociación de facturas y pagos.
     Recibe el DataFrame completo y devuelve el DataFrame de resultados.
     """
-    print("Iniciando procesamiento de asociación de pagos...")
+    logger.info("Iniciando procesamiento de asociación de pagos...")
     
-    # Separar facturas y pagos
-    facturas = df[df['CLASS'] == 'INV'].copy()
-    pagos = df[df['CLASS'] == 'PMT'].copy()
+    # Los montos vacíos nunca cubren una factura ni se usan como pago
+    df = df.dropna(subset=['INV_AMOUNT'])
 
-    # Calcular 88% del valor de la factura
-    facturas['INV_AMOUNT_88'] = facturas['INV_AMOUNT'] * 0.88
+    # Separar facturas y pagos con una sola pasada sobre CLASS
+    clases = indice_invertido(df, 'CLASS')
+    facturas = df.take(clases.get('INV', SIN_POSICIONES))
+    pagos = df.take(clases.get('PMT', SIN_POSICIONES))
 
-    # Inicializar lista de resultados
-    resultados = []
+    # Extraer las columnas necesarias como arreglos NumPy, con los montos en centavos enteros
+    trx_facturas = facturas['TRX_NUMBER'].to_numpy()
+    clientes_facturas = facturas['CUSTOMER_NAME'].to_numpy()
+    montos_facturas = a_centavos(facturas['INV_AMOUNT'])
+    trx_pagos = pagos['TRX_NUMBER'].to_numpy()
+    montos_pagos = a_centavos(pagos['INV_AMOUNT'])
 
-    # Copia de pagos disponibles (se convierte a lista de diccionarios para manipulación)
-    pagos_disponibles_df = pagos.copy()
-    
-    # Iterar sobre las facturas
-    for _, factura in facturas.iterrows():
-        cliente = factura['CUSTOMER_NAME']
-        trx_factura = factura['TRX_NUMBER']
-        valor_factura = factura['INV_AMOUNT']
-        valor_88 = factura['INV_AMOUNT_88']
-        
-        # Filtrar pagos del mismo cliente
-        pagos_cliente = pagos_disponibles_df[pagos_disponibles_df['CUSTOMER_NAME'] == cliente]
-        
-        # Convertir a lista de diccionarios para el manejo de combinaciones (más eficiente que iterar en DataFrames)
-        pagos_lista = pagos_cliente.to_dict('records')
-        
-        encontrada = False
-        pagos_a_eliminar = []
-
-        # 1. Buscar coincidencia con un solo pago
-        for pago in pagos_lista:
-            monto_pago = pago['INV_AMOUNT']
-            porcentaje = None
-            
-            if es_cobertura_valida(monto_pago, valor_factura):
-                porcentaje = "100%"
-            elif es_cobertura_valida(monto_pago, valor_88):
-                porcentaje = "88%"
-            
-            if porcentaje:
-                resultados.append({
-                    'Factura_TRX': trx_factura,
-                    'Cliente': cliente,
-                    'ValorFactura': valor_factura,
-                    'Pago_TRX': pago['TRX_NUMBER'],
-                    'ValorPago': monto_pago,
-                    'Porcentaje': porcentaje
-                })
-
-                pagos_a_eliminar.append(pago['TRX_NUMBER'])
-                encontrada = True
-                break  # Salir del loop si ya se encontró
-        
-        # Eliminar pagos usados antes de buscar combinaciones
-        if encontrada:
-            pagos_disponibles_df = pagos_disponibles_df[
-                ~pagos_disponibles_df['TRX_NUMBER'].isin(pagos_a_eliminar)
-            ]
-            continue
-
-        # 2. Buscar combinaciones de hasta 5 pagos
-        max_r = min(6, len(pagos_lista) + 1)
-        for r in range(2, max_r):
-            if encontrada: break
-            for combo in combinations(pagos_lista, r):
-                suma = sum(p['INV_AMOUNT'] for p in combo)
-                porcentaje = None
-                
-                if es_cobertura_valida(suma, valor_factura):
-                    porcentaje = "100%"
-                elif es_cobertura_valida(suma, valor_88):
-                    porcentaje = "88%"
-                
-                if porcentaje:
-                    pagos_en_combo = [p['TRX_NUMBER'] for p in combo]
-                    
-                    for p in combo:
-                        resultados.append({
-                            'Factura_TRX': trx_factura,
-                            'Cliente': cliente,
-                            'ValorFactura': valor_factura,
-                            'Pago_TRX': p['TRX_NUMBER'],
-                            'ValorPago': p['INV_AMOUNT'],
-                            'Porcentaje': porcentaje
-                        })
-                        pagos_a_eliminar.append(p['TRX_NUMBER'])
-
-                    encontrada = True
-                    break  # Salir si se encontró combinación válida
-        
-        # Eliminar pagos usados
-        if encontrada:
-             pagos_disponibles_df = pagos_disponibles_df[
-                ~pagos_disponibles_df['TRX_NUMBER'].isin(pagos_a_eliminar)
-            ]
-
-    # Crear DataFrame de resultados y devolverlo
-    df_resultado = pd.DataFrame(resultados)
+    # Calcular 100% y 88% del valor de la factura sin redondeo, en centésimas de centavo
+    objetivos_100 = montos_facturas * 100
+    objetivos_88 = montos_facturas * 88
+    montos_busqueda = montos_pagos * 100
+
+    # Índices invertidos por cliente (posiciones enteras de cada fila), construidos una sola vez
+    facturas_por_cliente = indice_invertido(facturas, 'CUSTOMER_NAME')
+    pagos_por_cliente = indice_invertido(pagos, 'CUSTOMER_NAME')
+
+    # Máscara de pagos aún no asociados, sobre todos los pagos
+    disponibles = np.ones(len(pagos), dtype=bool)
+
+    # Los clientes son independientes (solo compiten entre sí sus propias facturas y
+    # pagos), así que se procesan en paralelo con hilos. Cada uno escribe en disponibles
+    # únicamente sobre sus propias posiciones y los buscadores compilados liberan el GIL.
+    tareas = []
+    for cliente, posiciones_facturas in facturas_por_cliente.items():
+        posiciones_pagos = pagos_por_cliente.get(cliente, SIN_POSICIONES)
+        if posiciones_pagos.size:
+            tareas.append(delayed(asociar_cliente)(
+                posiciones_facturas, posiciones_pagos,
+                objetivos_100, objetivos_88, montos_busqueda, disponibles
+            ))
+    partes = Parallel(n_jobs=-1, prefer='threads')(tareas)
+
+    # Unir las columnas de resultados de todos los clientes
+    r_factura = []
+    r_pago = []
+    r_porcentaje = []
+    for facturas_cliente, pagos_cliente, porcentajes_cliente in partes:
+        r_factura.extend(facturas_cliente)
+        r_pago.extend(pagos_cliente)
+        r_porcentaje.extend(porcentajes_cliente)
+
+    # Devolver las filas en el orden de las facturas del archivo (el orden estable
+    # conserva el orden de los pagos dentro de cada factura)
+    r_factura = np.array(r_factura, dtype=np.int64)
+    orden = np.argsort(r_factura, kind='stable')
+    r_factura = r_factura[orden]
+    r_pago = np.array(r_pago, dtype=np.int64)[orden]
+    r_porcentaje = np.array(r_porcentaje, dtype=object)[orden]
+
+    # Crear DataFrame de resultados por columnas y devolverlo
+    df_resultado = pd.DataFrame({
+        'Factura_TRX': trx_facturas[r_factura],
+        'Cliente': clientes_facturas[r_factura],
+        'ValorFactura': montos_facturas[r_factura] / 100,
+        'Pago_TRX': trx_pagos[r_pago],
+        'ValorPago': montos_pagos[r_pago] / 100,
+        'Porcentaje': r_porcentaje
+    }, copy=False)
+    logger.info("Asociación completada: %d pagos asociados a %d facturas.", len(r_pago), len(np.unique(r_factura)))
     return df_resultado
 
+def procesar_y_guardar(df):
+    """
+    Tarea de la cola: ejecuta la asociación y devuelve el reporte Excel como bytes,
+    que RQ conserva en Redis como resultado del trabajo.
+    """
+    df_resultado = procesar_archivos_excel(df)
+
+    # Guardar el DataFrame de resultado en un buffer de memoria (Excel),
+    # sin analizar cada texto como posible URL
+    output = io.BytesIO()
+    opciones_excel = {'strings_to_urls': False, 'use_zip64': True}
+    with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs={'options': opciones_excel}) as writer:
+        # Escribir el DataFrame al buffer
+        df_resultado.to_excel(writer, index=False, sheet_name='Pagos_Asociados')
+
+    return output.getvalue()
+
 # --- Rutas de la Aplicación Web ---
 
 @app.route('/')
@@ -143,7 +493,8 @@ def index():
 @app.route('/process', methods=['POST'])
 def process_file():
     """
-    Maneja la carga del archivo, ejecuta la lógica de negocio y devuelve el resultado.
+    Maneja la carga del archivo, lo valida y encola su procesamiento.
+    Devuelve el identificador del trabajo para consultarlo en /result/<job_id>.
     """
     if 'file' not in request.files:
         return {'error': 'No se encontró el archivo en la solicitud.'}, 400
@@ -156,58 +507,93 @@ def process_file():
         return {'error': 'Formato de archivo no soportado. Por favor, sube un .xlsx o .xls.'}, 400
 
     df = None # Inicializar df para manejar errores de KeyError más tarde
+    required_columns = ['CLASS', 'INV_AMOUNT', 'CUSTOMER_NAME', 'TRX_NUMBER']
+    columnas_archivo = [] # Encabezados reales del archivo, para el diagnóstico
+
+    def seleccionar_columna(columna):
+        """Registra cada encabezado del archivo y conserva solo las columnas requeridas."""
+        if columna not in columnas_archivo:
+            columnas_archivo.append(columna)
+        return columna in required_columns
+
     try:
-        # Leer el archivo Excel cargado en memoria
-        file_stream = io.BytesIO(file.read())
-        df = pd.read_excel(file_stream)
+        # Leer el archivo Excel directamente del flujo subido, sin copiarlo a memoria
+        # (solo las columnas requeridas; los textos repetidos se cargan como categorías)
+        df = pd.read_excel(
+            file.stream,
+            engine='openpyxl' if file.filename.endswith('.xlsx') else None,
+            usecols=seleccionar_columna,
+            dtype={'CLASS': 'category', 'CUSTOMER_NAME': 'category', 'TRX_NUMBER': 'string'}
+        )
 
         # 1. Diagnóstico: Verificar columnas requeridas
-        required_columns = ['CLASS', 'INV_AMOUNT', 'CUSTOMER_NAME', 'TRX_NUMBER']
         missing_columns = [col for col in required_columns if col not in df.columns]
 
         if missing_columns:
              # Este error se enviará al frontend
              raise KeyError(f"Faltan las siguientes columnas requeridas: {', '.join(missing_columns)}")
         
-        # Ejecutar la lógica de procesamiento
-        df_resultado = procesar_archivos_excel(df)
-
-        # Guardar el DataFrame de resultado en un buffer de memoria (Excel)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            # Escribir el DataFrame al buffer
-            df_resultado.to_excel(writer, index=False, sheet_name='Pagos_Asociados')
-        
-        # Mover el puntero del buffer al inicio para la lectura
-        output.seek(0)
-        
-        # Devolver el archivo al cliente
-        return send_file(
-            output, 
-            as_attachment=True, 
-            download_name='Ageing_Pagos_Asociados.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        # Encolar la lógica de procesamiento para el worker
+        df = reducir_memoria(df)
+        job = cola.enqueue(
+            procesar_y_guardar, df,
+            job_timeout=TIEMPO_MAXIMO_TRABAJO,
+            result_ttl=TIEMPO_RESULTADO,
+            failure_ttl=TIEMPO_RESULTADO,
+            description=f'Asociación de pagos: {file.filename}'
         )
+        logger.info("Trabajo %s encolado.", job.id)
+
+        return {'job_id': job.id}, 202
 
     except KeyError as e:
         # Manejo específico para columnas faltantes o incorrectas
-        column_list = df.columns.tolist() if df is not None else "N/A"
+        column_list = columnas_archivo if df is not None else "N/A"
         error_msg = f'Error en el formato del archivo. {str(e)}. Las columnas encontradas son: {column_list}'
-        print(f"Error de Key: {error_msg}")
+        logger.error("Error de Key: %s", error_msg)
         return {'error': error_msg}, 400
 
     except EmptyDataError:
         # Manejo para archivo vacío
         error_msg = 'El archivo Excel está vacío o la hoja no contiene datos.'
-        print(f"Error de Datos Vacíos: {error_msg}")
+        logger.error("Error de Datos Vacíos: %s", error_msg)
         return {'error': error_msg}, 400
 
     except Exception as e:
         # Manejo para cualquier otro error inesperado
         error_msg = f'Ocurrió un error inesperado durante el procesamiento. Verifique los logs del servidor para detalles.'
-        print(f"Error General: {e}")
+        logger.exception("Error General: %s", e)
+        return {'error': error_msg}, 500
+
+@app.route('/result/<job_id>')
+def get_result(job_id):
+    """
+    Consulta el estado de un trabajo de procesamiento y, si ya terminó, devuelve el reporte.
+    """
+    try:
+        job = Job.fetch(job_id, connection=redis_conn)
+    except NoSuchJobError:
+        return {'error': 'No se encontró el trabajo solicitado o su resultado ya expiró.'}, 404
+
+    status = job.get_status()
+
+    if status == JobStatus.FINISHED:
+        # Devolver el archivo al cliente
+        return send_file(
+            io.BytesIO(job.return_value()),
+            as_attachment=True,
+            download_name='Ageing_Pagos_Asociados.xlsx',
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+    if status in (JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED):
+        logger.error("El trabajo %s terminó con estado %s.", job_id, status)
+        error_msg = 'Ocurrió un error inesperado durante el procesamiento. Verifique los logs del servidor para detalles.'
         return {'error': error_msg}, 500
 
+    # En cola o en ejecución
+    return {'status': status}, 202
+
 # Se incluye esta línea para que Flask sepa cómo ejecutarlo, 
 # aunque gunicorn (en tu Procfile) lo inicia directamente.
 if __name__ == '__main__':